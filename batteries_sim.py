@@ -1,14 +1,18 @@
 import argparse
 import itertools
 import json
-import statistics
 from pathlib import Path
-import matplotlib.pyplot as plt
+from xml.sax.saxutils import escape
+import numpy as np
+import orjson
 
 
 # Default known prefix (prepended to the pair-test order if no other prefix provided)
 KNOWN_PREFIX = [(6, 7), (0, 1), (3, 4), (0, 2), (1, 2), (3, 5), (4, 5)]
 
+# Popcount lookup table for a single byte
+POPCNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
 
 def all_placements(n=8, k=4):
     return list(itertools.combinations(range(n), k))
@@ -19,54 +23,104 @@ def make_default_sequence(n=8, prefix=None):
 
     Prefix items are validated (must be in canonical order and unique).
     """
-    all_pairs = list(itertools.combinations(range(n), 2))
+    all_pairs_list = list(itertools.combinations(range(n), 2))
+    all_pairs_set = set(all_pairs_list)
     prefix = prefix or []
     seen = set()
     prefix_filtered = []
     for p in prefix:
         tup = tuple(p)
-        if tup in all_pairs and tup not in seen:
+        if tup in all_pairs_set and tup not in seen:
             prefix_filtered.append(tup)
             seen.add(tup)
-    remaining = [p for p in all_pairs if p not in seen]
+    remaining = [p for p in all_pairs_list if p not in seen]
     return prefix_filtered + remaining
 
 
+def placement_masks(placements):
+    """Encode each placement as a bitmask (bit i set if battery i is good)."""
+    return np.array([sum(1 << i for i in p) for p in placements], dtype=np.uint16)
+
+
+def pair_masks(pairs):
+    """Encode each pair (a, b) as the bitmask (1<<a)|(1<<b)."""
+    return np.array([(1 << a) | (1 << b) for a, b in pairs], dtype=np.uint16)
+
+
+def pair_incidence(pairmask, pmask):
+    """Boolean matrix [pair, placement]: True where both batteries of the pair are good."""
+    return (pmask[None, :] & pairmask[:, None]) == pairmask[:, None]
+
+
+def seq_to_bytes(pairs):
+    """Encode a pair sequence (batteries 0..7) as bytes, one pair mask per byte."""
+    return bytes((1 << a) | (1 << b) for a, b in pairs)
+
+
+def bytes_to_seq(data):
+    """Decode seq_to_bytes output back to a list of (a, b) pairs with a < b."""
+    return [((m & -m).bit_length() - 1, m.bit_length() - 1) for m in data]
+
+
+def popcount16(masks):
+    """Number of set bits in each element of a uint16 array (one LUT lookup per byte)."""
+    return POPCNT[masks & 0xFF] + POPCNT[masks >> 8]
+
+
 def simulate_sequence(pairs, placements):
     """Simulate the provided ordered list of pairs against all placements.
 
     Returns a dict mapping placement->dict of {2:tests,3:tests,4:tests} (tests is int or None).
     """
+    pmask = placement_masks(placements)
+    confirmed = np.zeros(len(placements), dtype=np.uint16)
+    needed = {k: np.full(len(placements), -1, dtype=np.int8) for k in (2, 3, 4)}
+    masks = pair_masks(pairs)
+    # test True only if both batteries are good
+    incidence = pair_incidence(masks, pmask)
+    for t, (mask, hit) in enumerate(zip(masks, incidence), start=1):
+        confirmed[hit] |= mask
+        popcnt = popcount16(confirmed)
+        for k in (2, 3, 4):
+            needed[k][(needed[k] < 0) & (popcnt >= k)] = t
+        if (needed[4] >= 0).all():
+            break
     results = {}
-    for placement in placements:
-        confirmed = set()
-        needed = {2: None, 3: None, 4: None}
-        for t, pair in enumerate(pairs, start=1):
-            a, b = pair
-            # test True only if both batteries are good
-            if a in placement and b in placement:
-                confirmed.add(a)
-                confirmed.add(b)
-            for k in (2, 3, 4):
-                if needed[k] is None and len(confirmed) >= k:
-                    needed[k] = t
-            if all(v is not None for v in needed.values()):
-                break
-        results[placement] = needed
+    for i, placement in enumerate(placements):
+        results[placement] = {k: int(needed[k][i]) if needed[k][i] >= 0 else None for k in (2, 3, 4)}
     return results
 
 
+def histogram_stats(hist):
+    """Return (mean, median, min, max) of the values counted in hist (hist[v] = occurrences of v)."""
+    total = int(hist.sum())
+    nonzero = np.flatnonzero(hist)
+    value_sum = int((np.arange(len(hist)) * hist).sum())
+    # like statistics.mean on ints: a whole-number mean stays an int
+    mean = value_sum // total if value_sum % total == 0 else value_sum / total
+    # median from the cumulative counts: value at sorted position i is the first bin with cum > i
+    cum = np.cumsum(hist)
+    lo = int(np.searchsorted(cum, (total - 1) // 2, side='right'))
+    hi = int(np.searchsorted(cum, total // 2, side='right'))
+    median = lo if total % 2 else (lo + hi) / 2
+    return mean, median, int(nonzero[0]), int(nonzero[-1])
+
+
 def summarize(results):
     summary = {}
     for k in (2, 3, 4):
-        vals = [v[k] for v in results.values()]
-        found = [x for x in vals if x is not None]
+        vals = np.fromiter((-1 if v[k] is None else v[k] for v in results.values()), dtype=np.int16)
+        found = vals[vals >= 0]
         missing = len(vals) - len(found)
+        if len(found):
+            mean, median, lo, hi = histogram_stats(np.bincount(found))
+        else:
+            mean = median = lo = hi = None
         summary[k] = {
-            'mean': statistics.mean(found) if found else None,
-            'median': statistics.median(found) if found else None,
-            'min': min(found) if found else None,
-            'max': max(found) if found else None,
+            'mean': mean,
+            'median': median,
+            'min': lo,
+            'max': hi,
             'not_found_count': missing,
         }
     return summary
@@ -126,38 +180,76 @@ def plot_per_placement_histograms(results, out_prefix):
             labels.append('not_found')
             heights.append(counts['not_found'])
 
-        x = list(range(len(labels)))
-        plt.figure(figsize=(10, 4))
-        plt.bar(x, heights, color='C1')
-        plt.xticks(x, labels, rotation=45)
-        plt.xlabel('Tests to reach {} goods (or not_found)'.format(k))
-        plt.ylabel('Count of placements')
-        plt.title('Distribution of tests needed to find {} goods'.format(k))
-        plt.tight_layout()
-        out_path = f"{out_prefix}_find{k}.png"
-        plt.savefig(out_path)
-        plt.close()
+        svg = svg_bar_chart(
+            labels, heights,
+            title='Distribution of tests needed to find {} goods'.format(k),
+            xlabel='Tests to reach {} goods (or not_found)'.format(k),
+            ylabel='Count of placements',
+        )
+        out_path = f"{out_prefix}_find{k}.svg"
+        Path(out_path).write_text(svg, encoding='utf-8')
+
+
+def svg_bar_chart(labels, heights, title, xlabel, ylabel, width=1000, height=400):
+    """Render a simple bar chart as an SVG document string."""
+    left, right, top, bottom = 60, 20, 40, 70
+    plot_w = width - left - right
+    plot_h = height - top - bottom
+    ymax = max(heights, default=0) or 1
+    slot = plot_w / max(len(labels), 1)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="sans-serif" font-size="12">',
+        f'<rect width="{width}" height="{height}" fill="white"/>',
+        f'<text x="{width / 2}" y="{top / 2 + 6}" text-anchor="middle" font-size="14">{escape(title)}</text>',
+    ]
+    # y axis with integer ticks
+    step = max(1, -(-ymax // 5))
+    for v in range(0, ymax + 1, step):
+        y = top + plot_h - v / ymax * plot_h
+        parts.append(f'<line x1="{left - 4}" y1="{y:.1f}" x2="{left}" y2="{y:.1f}" stroke="black"/>')
+        parts.append(f'<text x="{left - 6}" y="{y + 4:.1f}" text-anchor="end">{v}</text>')
+    for i, (label, h) in enumerate(zip(labels, heights)):
+        bar_h = h / ymax * plot_h
+        x = left + i * slot
+        cx = x + slot / 2
+        parts.append(f'<rect x="{x + slot * 0.1:.1f}" y="{top + plot_h - bar_h:.1f}" '
+                     f'width="{slot * 0.8:.1f}" height="{bar_h:.1f}" fill="#ff7f0e"/>')
+        ly = top + plot_h + 14
+        parts.append(f'<text x="{cx:.1f}" y="{ly}" text-anchor="end" '
+                     f'transform="rotate(-45 {cx:.1f} {ly})">{escape(label)}</text>')
+    parts.append(f'<line x1="{left}" y1="{top}" x2="{left}" y2="{top + plot_h}" stroke="black"/>')
+    parts.append(f'<line x1="{left}" y1="{top + plot_h}" x2="{left + plot_w}" y2="{top + plot_h}" stroke="black"/>')
+    parts.append(f'<text x="{left + plot_w / 2}" y="{height - 8}" text-anchor="middle">{escape(xlabel)}</text>')
+    parts.append(f'<text x="16" y="{top + plot_h / 2}" text-anchor="middle" '
+                 f'transform="rotate(-90 16 {top + plot_h / 2})">{escape(ylabel)}</text>')
+    parts.append('</svg>')
+    return '\n'.join(parts) + '\n'
 
 
 def load_sequences(filepath):
     p = Path(filepath)
     if not p.exists():
         return {}
-    with p.open('r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = orjson.loads(p.read_bytes())
     out = {}
     for name, pairs in data.items():
         out[name] = [tuple(p) for p in pairs]
     return out
 
 
-def save_sequence(name, pairs, filepath):
-    p = Path(filepath)
-    data = {}
-    if p.exists():
-        data = json.loads(p.read_text(encoding='utf-8'))
-    data[name] = [list(t) for t in pairs]
-    p.write_text(json.dumps(data, indent=2), encoding='utf-8')
+class SequenceStore:
+    """Named sequences file, parsed once; add() edits it in memory and flush() writes it back."""
+
+    def __init__(self, filepath):
+        self.path = Path(filepath)
+        self.data = orjson.loads(self.path.read_bytes()) if self.path.exists() else {}
+
+    def add(self, name, pairs):
+        self.data[name] = [[int(a), int(b)] for a, b in pairs]
+
+    def flush(self):
+        self.path.write_bytes(orjson.dumps(self.data, option=orjson.OPT_INDENT_2))
 
 
 def parse_pairs_arg(s):
@@ -214,7 +306,9 @@ def main():
         return
 
     if args.save_name:
-        save_sequence(args.save_name, prefix, args.sequences_file)
+        store = SequenceStore(args.sequences_file)
+        store.add(args.save_name, prefix)
+        store.flush()
         print(f"Saved sequence '{args.save_name}' to {args.sequences_file}")
 
     full_pairs = make_default_sequence(8, prefix=prefix)
@@ -234,7 +328,7 @@ def main():
         if not p.exists():
             print(f"Plot input file not found: {args.plot_dump}")
         else:
-            data = json.loads(p.read_text(encoding='utf-8'))
+            data = orjson.loads(p.read_bytes())
             plot_per_placement_histograms(data, args.plot_out)
             print(f"Wrote per-placement histograms with prefix {args.plot_out}")
 
@@ -0,0 +1,145 @@
+"""
+Build the _batteries_c extension: a C version of sim_kernels.evaluate
+specialized for 8 batteries with 4 good (the 70 placement masks are baked in).
+With -march=native on an AVX2 machine all placements are simulated at once,
+16 per vector; otherwise a scalar loop is compiled.
+
+Run once with `python build_ckernel.py` (needs cffi and a C compiler);
+optimize_sequence uses the extension when it is importable.
+"""
+
+from cffi import FFI
+from batteries_sim import all_placements, placement_masks
+
+PMASK = placement_masks(all_placements(8, 4))
+
+C_SOURCE = """
+#include <math.h>
+#include <stdint.h>
+#ifdef __AVX2__
+#include <immintrin.h>
+#endif
+
+#define N_PLACEMENTS %(n_placements)d
+/* placements rounded up to whole 16-lane (uint16) AVX2 vectors */
+#define N_VEC ((N_PLACEMENTS + 15) / 16)
+
+/* padding lanes have mask 0: they never match a pair and are ignored */
+static const uint16_t PMASK[N_VEC * 16] = {%(pmask)s};
+
+#ifdef __AVX2__
+
+static void means_from_needed(const uint16_t *n2, const uint16_t *n3, const uint16_t *n4, double *out_means)
+{
+    int sum2 = 0, sum3 = 0, sum4 = 0;
+    int cnt2 = 0, cnt3 = 0, cnt4 = 0;
+    for (int i = 0; i < N_PLACEMENTS; i++) {
+        if (n2[i]) { sum2 += n2[i]; cnt2++; }
+        if (n3[i]) { sum3 += n3[i]; cnt3++; }
+        if (n4[i]) { sum4 += n4[i]; cnt4++; }
+    }
+    out_means[0] = cnt2 ? (double)sum2 / cnt2 : INFINITY;
+    out_means[1] = cnt3 ? (double)sum3 / cnt3 : INFINITY;
+    out_means[2] = cnt4 ? (double)sum4 / cnt4 : INFINITY;
+}
+
+/* per-lane popcount of 16-bit lanes: nibble lookup (Mula) then add the two bytes */
+static inline __m256i popcount_epi16(__m256i v)
+{
+    const __m256i lut = _mm256_setr_epi8(0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 4,
+                                         0, 1, 1, 2, 1, 2, 2, 3, 1, 2, 2, 3, 2, 3, 3, 4);
+    const __m256i low4 = _mm256_set1_epi8(0x0f);
+    __m256i lo = _mm256_shuffle_epi8(lut, _mm256_and_si256(v, low4));
+    __m256i hi = _mm256_shuffle_epi8(lut, _mm256_and_si256(_mm256_srli_epi16(v, 4), low4));
+    __m256i cnt8 = _mm256_add_epi8(lo, hi);
+    return _mm256_add_epi16(_mm256_and_si256(cnt8, _mm256_set1_epi16(0xff)), _mm256_srli_epi16(cnt8, 8));
+}
+
+void evaluate(const uint8_t *pair_masks, int npairs, double *out_means)
+{
+    const __m256i zero = _mm256_setzero_si256();
+    const __m256i one = _mm256_set1_epi16(1), two = _mm256_set1_epi16(2), three = _mm256_set1_epi16(3);
+    __m256i pm[N_VEC], real[N_VEC], confirmed[N_VEC], n2[N_VEC], n3[N_VEC], n4[N_VEC];
+    for (int r = 0; r < N_VEC; r++) {
+        pm[r] = _mm256_loadu_si256((const __m256i *)(PMASK + 16 * r));
+        real[r] = _mm256_xor_si256(_mm256_cmpeq_epi16(pm[r], zero), _mm256_set1_epi16(-1));
+        confirmed[r] = n2[r] = n3[r] = n4[r] = zero;
+    }
+    for (int t = 0; t < npairs; t++) {
+        const __m256i p = _mm256_set1_epi16(pair_masks[t]);
+        const __m256i test = _mm256_set1_epi16(t + 1);
+        int done = 1;
+        for (int r = 0; r < N_VEC; r++) {
+            /* test True only if both batteries are good */
+            __m256i hit = _mm256_cmpeq_epi16(_mm256_and_si256(pm[r], p), p);
+            confirmed[r] = _mm256_or_si256(confirmed[r], _mm256_and_si256(hit, p));
+            __m256i pc = popcount_epi16(confirmed[r]);
+            /* lanes reaching k goods for the first time get t + 1 */
+            n2[r] = _mm256_or_si256(n2[r], _mm256_and_si256(
+                _mm256_andnot_si256(_mm256_cmpgt_epi16(n2[r], zero), _mm256_cmpgt_epi16(pc, one)), test));
+            n3[r] = _mm256_or_si256(n3[r], _mm256_and_si256(
+                _mm256_andnot_si256(_mm256_cmpgt_epi16(n3[r], zero), _mm256_cmpgt_epi16(pc, two)), test));
+            n4[r] = _mm256_or_si256(n4[r], _mm256_and_si256(
+                _mm256_andnot_si256(_mm256_cmpgt_epi16(n4[r], zero), _mm256_cmpgt_epi16(pc, three)), test));
+            done &= _mm256_testz_si256(_mm256_cmpeq_epi16(n4[r], zero), real[r]);
+        }
+        if (done)
+            break;
+    }
+    uint16_t out2[N_VEC * 16], out3[N_VEC * 16], out4[N_VEC * 16];
+    for (int r = 0; r < N_VEC; r++) {
+        _mm256_storeu_si256((__m256i *)(out2 + 16 * r), n2[r]);
+        _mm256_storeu_si256((__m256i *)(out3 + 16 * r), n3[r]);
+        _mm256_storeu_si256((__m256i *)(out4 + 16 * r), n4[r]);
+    }
+    means_from_needed(out2, out3, out4, out_means);
+}
+
+#else
+
+void evaluate(const uint8_t *pair_masks, int npairs, double *out_means)
+{
+    int sum2 = 0, sum3 = 0, sum4 = 0;
+    int cnt2 = 0, cnt3 = 0, cnt4 = 0;
+    for (int i = 0; i < N_PLACEMENTS; i++) {
+        uint16_t placement = PMASK[i];
+        unsigned confirmed = 0;
+        int n2 = 0, n3 = 0, n4 = 0;
+        for (int t = 0; t < npairs; t++) {
+            uint8_t mask = pair_masks[t];
+            /* test True only if both batteries are good */
+            if ((placement & mask) == mask) {
+                confirmed |= mask;
+                int pc = __builtin_popcount(confirmed);
+                if (!n2 && pc >= 2)
+                    n2 = t + 1;
+                if (!n3 && pc >= 3)
+                    n3 = t + 1;
+                if (pc >= 4) {
+                    n4 = t + 1;
+                    break;
+                }
+            }
+        }
+        if (n2) { sum2 += n2; cnt2++; }
+        if (n3) { sum3 += n3; cnt3++; }
+        if (n4) { sum4 += n4; cnt4++; }
+    }
+    out_means[0] = cnt2 ? (double)sum2 / cnt2 : INFINITY;
+    out_means[1] = cnt3 ? (double)sum3 / cnt3 : INFINITY;
+    out_means[2] = cnt4 ? (double)sum4 / cnt4 : INFINITY;
+}
+
+#endif
+""" % {
+    'n_placements': len(PMASK),
+    'pmask': ', '.join(str(int(m)) for m in PMASK),  # the rest of the array is zero-initialized
+}
+
+ffibuilder = FFI()
+ffibuilder.cdef("void evaluate(const uint8_t *pair_masks, int npairs, double *out_means);")
+ffibuilder.set_source("_batteries_c", C_SOURCE, extra_compile_args=['-O3', '-march=native'])
+
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
@@ -4,53 +4,74 @@ Uses batteries_sim to evaluate sequences and track the best one found.
 """
 
 import itertools
-import random
+import signal
 import sys
-from batteries_sim import all_placements, simulate_sequence, summarize
+import numpy as np
+from batteries_sim import (all_placements, bytes_to_seq, pair_incidence, placement_masks, pair_masks, seq_to_bytes,
+                           simulate_sequence, summarize)
+from sim_kernels import advance, evaluate, evaluate_batch, evaluate_from, new_state
 
-def generate_random_sequence(n=8):
-    """Generate a random sequence of pairs, always starting with (0,1).
-    
-    Returns a list of unique pairs in random order, with (0,1) always first.
-    """
-    all_pairs = list(itertools.combinations(range(n), 2))
-    # Remove (0,1) from candidates since it's always first
-    remaining = [p for p in all_pairs if p != (0, 1)]
-    # Shuffle the remaining pairs
-    random.shuffle(remaining)
-    return [(0, 1)] + remaining
+# Optional C kernel specialized for 8 batteries / 4 good (built by build_ckernel.py)
+try:
+    from _batteries_c import ffi, lib as ckernel
+except ImportError:
+    ckernel = None
 
+# Encodings shared by every iteration of the search (8 batteries, 4 good)
+PLACEMENTS = all_placements(8, 4)
+PMASK = placement_masks(PLACEMENTS)
+PAIRS = list(itertools.combinations(range(8), 2))
+PAIRMASK = np.frombuffer(seq_to_bytes(PAIRS), dtype=np.uint8)
+FIRST_IDX = PAIRS.index((0, 1))
 
-def metric_score(summary, target_k=4):
-    """Compute a scalar score from summary for optimization. Lower is better.
-    
-    Uses mean tests to find target_k goods.
-    """
-    if summary[target_k]['mean'] is None:
-        return float('inf')
-    return summary[target_k]['mean']
+# Number of random sequences generated and evaluated per parallel kernel call
+BATCH_SIZE = 10_000
 
 
-def print_all_best_summaries(best_scores, best_sequences, best_summaries):
-    """Print a summary of all best sequences found so far."""
-    print("  --- Current best sequences for all targets ---")
-    for k in (2, 3, 4):
-        if best_sequences[k]:
-            s = best_summaries[k][k]
-            print(f"  Find {k}:{s['mean']:.4f}:{s['median']:.0f}: {best_sequences[k][:s['max']]}, min={s['min']}, max={s['max']}, not_found={s['not_found_count']}")
-        else:
-            print(f"  Find {k} goods: not yet found")
-    print()
+def local_search(seq, col):
+    """Hill-climb from seq (pair-mask bytes) by swapping two pairs (never the leading (0,1)).
+    
+    Keeps every swap that lowers means[col] (col 0/1/2 = finding 2/3/4 goods)
+    and repeats until no swap helps. Returns (seq, means) of the local optimum.
+    """
+    pm = np.frombuffer(seq, dtype=np.uint8).copy()
+    best = evaluate(pm, PMASK)
+    if ckernel is not None:
+        # Swaps happen in place, so the C view of pm stays valid throughout
+        c_pm, c_means = ffi.from_buffer(pm), ffi.new('double[3]')
+    improved = True
+    while improved:
+        improved = False
+        # Swaps at positions i<j leave the first i tests alone: snapshot the
+        # state after them once and only re-simulate from step i (the C
+        # kernel always runs the whole sequence, so it needs no snapshot)
+        if ckernel is None:
+            prefix = new_state(len(PMASK))
+            advance(prefix, pm, PMASK, 0, 1)
+        for i in range(1, len(pm) - 1):
+            for j in range(i + 1, len(pm)):
+                pm[i], pm[j] = pm[j], pm[i]
+                if ckernel is not None:
+                    ckernel.evaluate(c_pm, len(pm), c_means)
+                    means = tuple(c_means)
+                else:
+                    means = evaluate_from(prefix, pm, PMASK, i)
+                if means[col] < best[col]:
+                    best = means
+                    improved = True
+                else:
+                    pm[i], pm[j] = pm[j], pm[i]
+            if ckernel is None:
+                advance(prefix, pm, PMASK, i, i + 1)
+    return pm.tobytes(), best
 
 
 def count_matches_per_pair(pairs, placements):
-    """Count how many placements each pair matches (both elements in placement)."""
-    counts = {}
-    for pair in pairs:
-        a, b = pair
-        count = sum(1 for placement in placements if a in placement and b in placement)
-        counts[pair] = count
-    return counts
+    """Count how many placements each pair matches (both elements in placement).
+    
+    Returns an array of counts aligned with pairs.
+    """
+    return pair_incidence(pair_masks(pairs), placement_masks(placements)).sum(1)
 
 
 def reorder_by_match_count(sequence, placements):
@@ -58,72 +79,79 @@ def reorder_by_match_count(sequence, placements):
     if not sequence or sequence[0] != (0, 1):
         return sequence
     
-    counts = count_matches_per_pair(sequence, placements)
-    
-    # Keep (0,1) first, sort the rest by descending match count
-    rest = sequence[1:]
-    rest_sorted = sorted(rest, key=lambda p: counts[p], reverse=True)
-    return [(0, 1)] + rest_sorted
+    # Keep (0,1) first, sort the rest by descending match count (stable, like sorted)
+    counts = count_matches_per_pair(sequence[1:], placements)
+    order = np.argsort(-counts, kind='stable')
+    return [(0, 1)] + [sequence[1 + i] for i in order]
 
 
 def main():
-    placements = all_placements(8, 4)
+    # Block-buffer stdout: output is only flushed with the progress lines and at shutdown
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
     
-    # Track best sequence for each target separately
+    # Track best sequence (pair-mask bytes) for each target separately
     best_scores = {2: float('inf'), 3: float('inf'), 4: float('inf')}
     best_sequences = {2: None, 3: None, 4: None}
-    best_summaries = {2: None, 3: None, 4: None}
+    # Improvements as (iteration, k, score), reported at shutdown
+    history = []
     iteration = 0
     
     print("Starting sequence optimization (Ctrl+C to stop)...")
     print("Tracking best sequences for finding 2, 3, and 4 goods separately")
     print()
+    sys.stdout.flush()
+    
+    rng = np.random.default_rng()
+    # Ctrl+C only sets a flag: a KeyboardInterrupt raised while the parallel
+    # kernel is running surfaces as a SystemError, so stop between batches instead.
+    # The first Ctrl+C puts the previous handler back, so a second one aborts.
+    interrupted = []
     
+    def on_sigint(signum, frame):
+        interrupted.append(signum)
+        signal.signal(signal.SIGINT, previous_handler)
+    
+    previous_handler = signal.signal(signal.SIGINT, on_sigint)
     try:
-        while True:
-            iteration += 1
-            
-            # Generate a random sequence
-            sequence = generate_random_sequence(8)
+        while not interrupted:
+            # Generate and evaluate a batch of random sequences (mean tests for 2, 3 and 4 goods)
+            seqs, means = evaluate_batch(int(rng.integers(2**62)), BATCH_SIZE, PAIRMASK, PMASK, FIRST_IDX)
             
-            # Evaluate the original sequence
-            results = simulate_sequence(sequence, placements)
-            summary = summarize(results)
-            
-            # Check for improvement on each target
-            improvement_found = False
-            for k in (2, 3, 4):
-                score = metric_score(summary, target_k=k)
+            # Refine the best of the batch for each target by local search and check for improvement
+            for col, k in enumerate((2, 3, 4)):
+                b = int(means[:, col].argmin())
+                seq, local_means = local_search(seqs[b].tobytes(), col)
+                score = local_means[col]
                 if score < best_scores[k]:
                     best_scores[k] = score
-                    best_sequences[k] = sequence
-                    best_summaries[k] = summary
-                    print(f"Iteration {iteration}: IMPROVED for finding {k} goods! (original order)")
-                    print(f"  Score (mean tests): {score:.4f}")
-                    print(f"  Sequence: {sequence}")
-                    improvement_found = True
-            
-            # If any improvement, print all best summaries
-            if improvement_found:
-                print_all_best_summaries(best_scores, best_sequences, best_summaries)
+                    best_sequences[k] = seq
+                    history.append((iteration + b + 1, k, score))
+            iteration += BATCH_SIZE
             
             # Print progress every 100k iterations
             if iteration % 100000 == 0:
-                print(f"Iteration {iteration}: current best scores = "
-                      f"2->{best_scores[2]:.4f}, 3->{best_scores[3]:.4f}, 4->{best_scores[4]:.4f}")
+                print("Iteration %d: current best scores = 2->%.4f, 3->%.4f, 4->%.4f"
+                      % (iteration, best_scores[2], best_scores[3], best_scores[4]))
+                sys.stdout.flush()
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
     
-    except KeyboardInterrupt:
-        print("\nStopped by user.")
-        print(f"\nBest sequences found in {iteration} iterations:\n")
-        for k in (2, 3, 4):
-            if best_sequences[k]:
-                print(f"Best for finding {k} goods:")
-                print(f"  Sequence: {best_sequences[k]}")
-                s = best_summaries[k][k]
-                print(f"  Score: {best_scores[k]:.4f}")
-                print(f"  Mean={s['mean']:.4f}, Median={s['median']}, "
-                      f"Min={s['min']}, Max={s['max']}, Not found={s['not_found_count']}")
-                print()
+    print("\nStopped by user.")
+    print("\nImprovements (iteration: target -> mean tests):")
+    for it, k, score in sorted(history):
+        print("  %d: %d -> %.4f" % (it, k, score))
+    print(f"\nBest sequences found in {iteration} iterations:\n")
+    for k in (2, 3, 4):
+        if best_sequences[k]:
+            sequence = bytes_to_seq(best_sequences[k])
+            s = summarize(simulate_sequence(sequence, PLACEMENTS))[k]
+            print(f"Best for finding {k} goods:")
+            print(f"  Sequence: {sequence}")
+            print(f"  Score: {best_scores[k]:.4f}")
+            print(f"  Mean={s['mean']:.4f}, Median={s['median']}, "
+                  f"Min={s['min']}, Max={s['max']}, Not found={s['not_found_count']}")
+            print()
+    sys.stdout.flush()
 
 
 if __name__ == '__main__':
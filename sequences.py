@@ -6,8 +6,9 @@ Example partitions: (3,3,2), (2,3,3), (2,2,4), etc.
 Each group is covered by pairs that span or mix indices within/across groups.
 """
 
+import heapq
 import itertools
-from batteries_sim import all_placements, simulate_sequence, summarize
+from batteries_sim import SequenceStore, all_placements, seq_to_bytes, simulate_sequence, summarize
 
 
 def generate_partition_based_sequences(n=8):
@@ -56,13 +57,25 @@ def generate_partitions(indices, sizes):
         yield []
         return
     
-    size = sizes[0]
-    remaining_sizes = sizes[1:]
-    
-    for group in itertools.combinations(indices, size):
-        remaining_indices = [i for i in indices if i not in group]
-        for rest in generate_partitions(remaining_indices, remaining_sizes):
-            yield [list(group)] + rest
+    # Depth-first over an explicit stack: one combinations iterator per chosen group
+    groups = []
+    remaining = [list(indices)]
+    stack = [itertools.combinations(indices, sizes[0])]
+    while stack:
+        depth = len(stack) - 1
+        del groups[depth:]
+        group = next(stack[-1], None)
+        if group is None:
+            stack.pop()
+            remaining.pop()
+            continue
+        groups.append(group)
+        if depth + 1 == len(sizes):
+            yield [list(g) for g in groups]
+            continue
+        rest = [i for i in remaining[-1] if i not in group]
+        remaining.append(rest)
+        stack.append(itertools.combinations(rest, sizes[depth + 1]))
 
 
 def generate_covering_sequence(groups):
@@ -83,81 +96,68 @@ def generate_covering_sequence(groups):
     else:
         remaining_pairs = all_pairs
     
-    # Sort remaining pairs: prioritize those crossing groups
-    def crossing_count(pair):
-        a, b = pair
-        group_a = next((i for i, g in enumerate(groups) if a in g), -1)
-        group_b = next((i for i, g in enumerate(groups) if b in g), -1)
-        return 0 if group_a == group_b else 1  # Crossing pairs first
-    
-    remaining_pairs.sort(key=crossing_count, reverse=True)
-    sequence.extend(remaining_pairs)
+    # Pairs crossing groups first, then pairs within a group (each in original order)
+    idx_to_group = {idx: g_i for g_i, group in enumerate(groups) for idx in group}
+    sequence.extend(p for p in remaining_pairs if idx_to_group[p[0]] != idx_to_group[p[1]])
+    sequence.extend(p for p in remaining_pairs if idx_to_group[p[0]] == idx_to_group[p[1]])
     
     return sequence
 
 
 def evaluate_partition_sequences():
-    """Generate and evaluate all partition-based sequences."""
+    """Generate and evaluate all partition-based sequences.
+    
+    Yields (mean4, sequence, summary) tuples, where mean4 is the mean number of
+    tests to find 4 goods (inf if never found).
+    """
     placements = all_placements(8, 4)
     
-    results = []
-    for i, sequence in enumerate(generate_partition_based_sequences(8)):
-        result_dict = simulate_sequence(sequence, placements)
-        summary = summarize(result_dict)
+    # Different partitions often produce the same sequence; simulate each one once
+    summaries = {}
+    for sequence in generate_partition_based_sequences(8):
+        key = seq_to_bytes(sequence)
+        summary = summaries.get(key)
+        if summary is None:
+            summary = summarize(simulate_sequence(sequence, placements))
+            summaries[key] = summary
         
-        results.append({
-            'sequence': sequence,
-            'summary': summary,
-            'index': i,
-        })
-    
-    return results
+        mean4 = summary[4]['mean']
+        yield (mean4 if mean4 is not None else float('inf')), sequence, summary
 
 
 def print_results(results, top_k=10):
-    """Print results sorted by mean tests for finding 4 goods."""
-    # Sort by mean tests for 4 goods
-    sorted_results = sorted(
-        results,
-        key=lambda r: r['summary'][4]['mean'] if r['summary'][4]['mean'] is not None else float('inf')
-    )
-    
-    print(f"Generated {len(results)} partition-based sequences\n")
+    """Print the top_k results by mean tests for finding 4 goods.
+    
+    results may be a generator from evaluate_partition_sequences; only the
+    top_k are kept in memory. Returns them, best first.
+    """
+    total = 0
+    
+    def counted():
+        nonlocal total
+        for r in results:
+            total += 1
+            yield r
+    
+    top = heapq.nsmallest(top_k, counted(), key=lambda r: r[0])
+    
+    print(f"Generated {total} partition-based sequences\n")
     print(f"Top {top_k} by mean tests to find 4 goods:\n")
     
-    for rank, result in enumerate(sorted_results[:top_k], 1):
-        seq = result['sequence']
-        s = result['summary']
+    for rank, (_, seq, s) in enumerate(top, 1):
         print(f"{rank}. Sequence (first 5): {seq[:5]}...")
         print(f"   Find 2: mean={s[2]['mean']:.2f}, Find 3: mean={s[3]['mean']:.2f}, Find 4: mean={s[4]['mean']:.2f}")
         print(f"   Full sequence: {seq}")
         print()
+    return top
 
 
 def save_best_as_json(results, filepath, top_n=5):
     """Save top N sequences to sequences.json."""
-    import json
-    from pathlib import Path
-    
-    # Sort by mean tests for 4 goods
-    sorted_results = sorted(
-        results,
-        key=lambda r: r['summary'][4]['mean'] if r['summary'][4]['mean'] is not None else float('inf')
-    )
-    
-    data = {}
-    for i, result in enumerate(sorted_results[:top_n], 1):
-        seq = result['sequence']
-        s = result['summary'][4]
-        name = f"partition_top{i}"
-        data[name] = [list(p) for p in seq]
-    
-    p = Path(filepath)
-    if p.exists():
-        existing = json.loads(p.read_text(encoding='utf-8'))
-        data = {**existing, **data}
-    
-    p.write_text(json.dumps(data, indent=2), encoding='utf-8')
+    store = SequenceStore(filepath)
+    for i, (_, seq, _) in enumerate(heapq.nsmallest(top_n, results, key=lambda r: r[0]), 1):
+        store.add(f"partition_top{i}", seq)
+    store.flush()
     print(f"Saved top {top_n} sequences to {filepath}")
 
 
@@ -165,9 +165,8 @@ if __name__ == '__main__':
     import sys
     
     print("Generating and evaluating partition-based sequences...\n")
-    results = evaluate_partition_sequences()
-    print_results(results, top_k=15)
+    top = print_results(evaluate_partition_sequences(), top_k=15)
     
-    # Optionally save to sequences.json
+    # Optionally save to sequences.json (the top 5 are among the top 15 printed)
     if '--save' in sys.argv:
-        save_best_as_json(results, 'sequences.json', top_n=5)
+        save_best_as_json(top, 'sequences.json', top_n=5)
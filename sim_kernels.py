@@ -0,0 +1,166 @@
+"""
+Numba-compiled kernels for the hot evaluation path of optimize_sequence.
+
+Placements and pairs are passed pre-encoded as bitmasks
+(see batteries_sim.placement_masks / batteries_sim.pair_masks).
+"""
+
+import numpy as np
+from numba import njit, prange
+from batteries_sim import POPCNT
+
+
+@njit(cache=True)
+def evaluate(pair_masks, pmask):
+    """Simulate the pair sequence against all placements and return mean tests.
+
+    Returns (mean2, mean3, mean4): the mean number of tests needed to find
+    2, 3 and 4 goods over the placements where the target was reached
+    (inf if it was never reached).
+    """
+    sum2 = sum3 = sum4 = 0
+    cnt2 = cnt3 = cnt4 = 0
+    for i in range(pmask.shape[0]):
+        placement = pmask[i]
+        confirmed = 0
+        n2 = n3 = n4 = 0
+        for t in range(pair_masks.shape[0]):
+            mask = pair_masks[t]
+            # test True only if both batteries are good
+            if (placement & mask) == mask:
+                confirmed |= mask
+                pc = POPCNT[confirmed & 0xFF] + POPCNT[confirmed >> 8]
+                if n2 == 0 and pc >= 2:
+                    n2 = t + 1
+                if n3 == 0 and pc >= 3:
+                    n3 = t + 1
+                if n4 == 0 and pc >= 4:
+                    n4 = t + 1
+                    break
+        if n2:
+            sum2 += n2
+            cnt2 += 1
+        if n3:
+            sum3 += n3
+            cnt3 += 1
+        if n4:
+            sum4 += n4
+            cnt4 += 1
+    mean2 = sum2 / cnt2 if cnt2 else np.inf
+    mean3 = sum3 / cnt3 if cnt3 else np.inf
+    mean4 = sum4 / cnt4 if cnt4 else np.inf
+    return mean2, mean3, mean4
+
+
+def new_state(n_placements):
+    """Return the simulation state before any test, for n_placements placements.
+
+    Row 0 holds the confirmed-good bitmask of each placement, rows 1-3 the
+    number of tests needed to find 2, 3 and 4 goods (0 while not reached).
+    """
+    return np.zeros((4, n_placements), dtype=np.int32)
+
+
+@njit(cache=True)
+def advance(state, pair_masks, pmask, start, stop):
+    """Run tests start..stop-1 of the sequence, updating state in place."""
+    for i in range(pmask.shape[0]):
+        if state[3, i]:
+            continue
+        placement = pmask[i]
+        confirmed = state[0, i]
+        for t in range(start, stop):
+            mask = pair_masks[t]
+            if (placement & mask) == mask:
+                confirmed |= mask
+                pc = POPCNT[confirmed & 0xFF] + POPCNT[confirmed >> 8]
+                if state[1, i] == 0 and pc >= 2:
+                    state[1, i] = t + 1
+                if state[2, i] == 0 and pc >= 3:
+                    state[2, i] = t + 1
+                if pc >= 4:
+                    state[3, i] = t + 1
+                    break
+        state[0, i] = confirmed
+
+
+@njit(cache=True)
+def evaluate_from(state, pair_masks, pmask, start):
+    """Resume from state (taken after the first start tests) and return mean tests.
+
+    Gives the same result as evaluate on the whole sequence, without
+    re-running the prefix; state itself is left untouched.
+    """
+    sum2 = sum3 = sum4 = 0
+    cnt2 = cnt3 = cnt4 = 0
+    for i in range(pmask.shape[0]):
+        placement = pmask[i]
+        confirmed = state[0, i]
+        n2 = state[1, i]
+        n3 = state[2, i]
+        n4 = state[3, i]
+        if n4 == 0:
+            for t in range(start, pair_masks.shape[0]):
+                mask = pair_masks[t]
+                if (placement & mask) == mask:
+                    confirmed |= mask
+                    pc = POPCNT[confirmed & 0xFF] + POPCNT[confirmed >> 8]
+                    if n2 == 0 and pc >= 2:
+                        n2 = t + 1
+                    if n3 == 0 and pc >= 3:
+                        n3 = t + 1
+                    if pc >= 4:
+                        n4 = t + 1
+                        break
+        if n2:
+            sum2 += n2
+            cnt2 += 1
+        if n3:
+            sum3 += n3
+            cnt3 += 1
+        if n4:
+            sum4 += n4
+            cnt4 += 1
+    mean2 = sum2 / cnt2 if cnt2 else np.inf
+    mean3 = sum3 / cnt3 if cnt3 else np.inf
+    mean4 = sum4 / cnt4 if cnt4 else np.inf
+    return mean2, mean3, mean4
+
+
+@njit(cache=True)
+def xorshift64(x):
+    """Advance a (nonzero) uint64 xorshift state."""
+    x ^= x << np.uint64(13)
+    x ^= x >> np.uint64(7)
+    x ^= x << np.uint64(17)
+    return x
+
+
+@njit(parallel=True, cache=True)
+def evaluate_batch(seed, batch_size, pair_masks, pmask, first_idx):
+    """Generate and evaluate batch_size random orders of pair_masks in parallel.
+
+    Every order starts with pair_masks[first_idx]; the rest is a Fisher-Yates
+    shuffle driven by a per-sequence xorshift RNG seeded from seed ^ b.
+    Returns (seqs, means): seqs is (batch_size, npairs) pair masks (one
+    sequence per row), means is (batch_size, 3) as returned by evaluate.
+    """
+    npairs = pair_masks.shape[0]
+    seqs = np.empty((batch_size, npairs), dtype=pair_masks.dtype)
+    means = np.empty((batch_size, 3))
+    for b in prange(batch_size):
+        # splitmix64-style scramble so neighbouring b get unrelated streams
+        x = np.uint64(seed ^ b) * np.uint64(0x9E3779B97F4A7C15)
+        x ^= x >> np.uint64(31)
+        x |= np.uint64(1)
+        seq = seqs[b]
+        for j in range(npairs):
+            seq[j] = pair_masks[j]
+        seq[0] = pair_masks[first_idx]
+        seq[first_idx] = pair_masks[0]
+        for j in range(npairs - 1, 1, -1):
+            x = xorshift64(x)
+            r = 1 + np.int64(x % np.uint64(j))
+            seq[j], seq[r] = seq[r], seq[j]
+        means[b, 0], means[b, 1], means[b, 2] = evaluate(seq, pmask)
+    return seqs, means